@@ -1,23 +1,57 @@
+import math
+import re
+import warnings
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from operator import attrgetter
+
+import numpy as np
+import pandas as pd
 import streamlit as st
-import yfinance as yf
 from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from requests_cache import CacheMixin, SQLiteCache
 from requests_ratelimiter import LimiterMixin, MemoryQueueBucket
 from pyrate_limiter import Duration, RequestRate, Limiter
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 
-class CachedLimiterSession(CacheMixin, LimiterMixin, Session):
-    pass
+# Upper bound in seconds for any single Yahoo request, so a stalled endpoint can't hang a rerun
+REQUEST_TIMEOUT = 10
 
-session = CachedLimiterSession(
-    limiter=Limiter(RequestRate(2, Duration.SECOND*5)),  # max 2 requests per 5 seconds
-    bucket_class=MemoryQueueBucket,
-    backend=SQLiteCache("yfinance.cache"),
-)
+def cap_timeout(timeout):
+    """Clamps a requests timeout, either a number or a (connect, read) tuple, to REQUEST_TIMEOUT."""
+    if isinstance(timeout, tuple):
+        return tuple(min(part or REQUEST_TIMEOUT, REQUEST_TIMEOUT) for part in timeout)
+    return min(timeout or REQUEST_TIMEOUT, REQUEST_TIMEOUT)
 
-# Initialize session state for screenshots if it doesn't exist
-if "screenshots" not in st.session_state:
-    st.session_state["screenshots"] = []
+class CachedLimiterSession(CacheMixin, LimiterMixin, Session):
+    def request(self, method, url, *args, **kwargs):
+        kwargs["timeout"] = cap_timeout(kwargs.get("timeout"))
+        return super().request(method, url, *args, **kwargs)
+
+@st.cache_resource(show_spinner=False)
+def get_session():
+    """Builds the shared yfinance HTTP session once per server, so limiter state and the SQLite handle survive reruns."""
+    session = CachedLimiterSession(
+        limiter=Limiter(RequestRate(60, Duration.MINUTE)),  # max 60 requests per minute, Yahoo's limit
+        bucket_class=MemoryQueueBucket,
+        backend=SQLiteCache("yfinance.cache"),
+        expire_after=3600,  # fundamentals change quarterly; refresh cached responses hourly
+    )
+    # Size the connection pool for the concurrent bundle and multi-ticker fetches, and retry transient failures.
+    # Read timeouts are not retried, and retries skip the rate limiter, so keep them few. 429 is left to the
+    # caller rather than retried, and Retry-After is ignored so a server-requested sleep can't outlast REQUEST_TIMEOUT.
+    session.mount("https://", HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=2, read=0, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504), respect_retry_after_header=False
+        )
+    ))
+    return session
 
 def take_screenshot():
     screenshot = pyautogui.screenshot()
@@ -27,136 +61,321 @@ def take_screenshot():
     st.session_state["screenshots"].append(buffer)
     st.success("Screenshot taken and saved!")
 
-def fetch_company_data(ticker):
+# Yahoo symbols: optional ^ for indices, then letters/digits with . - = & (e.g. RELIANCE.NS, M&M.NS)
+_TICKER_RE = re.compile(r'^\^?[A-Z0-9][A-Z0-9.\-=&]{0,15}$')
+
+# Balance sheet row labels per CompanyData field, in order of preference
+BALANCE_SHEET_LABELS = {
+    'total_assets': ('Total Assets',),
+    'total_liabilities': ('Total Liabilities Net Minority Interest', 'Total Liabilities'),
+    'long_term_debt': ('Long Term Debt', 'Long Term Debt And Capital Lease Obligation')
+}
+
+# Yahoo suffixes for NSE and BSE listings, used when info carries no currency
+INDIAN_EXCHANGE_SUFFIXES = ('.NS', '.BO')
+
+@dataclass(slots=True, frozen=True)
+class CompanyData:
+    """Fundamentals and statements displayed for one ticker; None marks a value Yahoo did not report."""
+    company: str
+    business_summary: str
+    sector: str | None
+    industry: str | None
+    market_cap: float | None
+    currency: str
+    financial_currency: str
+    eps: float | None
+    pe_ratio: float | None
+    roe: float | None
+    net_profit_margin: float | None
+    dividend_yield: float | None
+    roe_pct: float | None
+    net_profit_margin_pct: float | None
+    dividend_yield_pct: float | None
+    total_assets: float | None
+    total_liabilities: float | None
+    long_term_debt: float | None
+    calendar: object
+    quarterly_balance_sheet: pd.DataFrame | None
+    quarterly_cash_flow: pd.DataFrame | None
+    # Rendered overview and tables, filled in by build_company_display so they share this entry's cache lifetime
+    overview: str = ""
+    fundamentals_table: pd.DataFrame | None = None
+    financials_table: pd.DataFrame | None = None
+
+BUNDLE_FIELDS = ('info', 'quarterly_balance_sheet', 'quarterly_cashflow', 'calendar')
+# Fields the app cannot render without; a failure here must fail the whole fetch
+REQUIRED_BUNDLE_FIELDS = ('info',)
+
+def get_ticker(ticker):
+    """Returns a fresh yfinance Ticker on the shared session; Tickers memoize their data, so they are not cached."""
+    import yfinance as yf
+
+    return yf.Ticker(ticker, session=get_session())
+
+def fetch_ticker_field(company, field):
+    """Reads one optional yfinance property, returning None if that endpoint fails so the rest of the bundle survives."""
     try:
-        company = yf.Ticker(ticker)
-        info = company.info
-        balance_sheet = company.quarterly_balance_sheet
-        cash_flow = company.quarterly_cashflow
-        calendar = company.calendar
-
-        # Financial Metrics
-        total_assets = balance_sheet.loc['Total Assets'][0] if 'Total Assets' in balance_sheet.index else None
-        total_liabilities = balance_sheet.loc['Total Liabilities Net Minority Interest'][0] if 'Total Liabilities Net Minority Interest' in balance_sheet.index else None
-        long_term_debt = balance_sheet.loc['Long Term Debt'][0] if 'Long Term Debt' in balance_sheet.index else None
-
-        # Key Data
-        eps = info.get('trailingEps', None)
-        pe_ratio = info.get('trailingPE', None)
-        roe = info.get('returnOnEquity', None)
-        net_profit_margin = info.get('profitMargins', None)
-        dividend_yield = info.get('dividendYield', None)
-        market_cap = info.get('marketCap', None)
-        sector = info.get('sector', None)
-        business_summary = info.get('longBusinessSummary', 'No business summary available')
-        industry = info.get('industry', None)
-        company_name = info.get('longName', ticker)
-
-        return {
-            'Company': company_name,
-            'Business Summary': business_summary,
-            'Sector': sector,
-            'Industry': industry,
-            'Market Cap': market_cap,
-            'EPS': eps,
-            'P/E Ratio': pe_ratio,
-            'ROE': roe,
-            'Net Profit Margin': net_profit_margin,
-            'Dividend Yield': dividend_yield,
-            'Total Assets': total_assets,
-            'Total Liabilities': total_liabilities,
-            'Long Term Debt': long_term_debt,
-            'Calendar': calendar,
-            'Quarterly Balance Sheet': balance_sheet,
-            'Quarterly Cash Flow': cash_flow
+        return getattr(company, field)
+    except Exception as e:
+        warnings.warn(f"Could not fetch {field} for {company.ticker}: {e}")
+        return None
+
+def get_ticker_bundle(ticker):
+    """Fetches every yfinance payload the app needs for a ticker, issuing the requests concurrently."""
+    company = get_ticker(ticker)
+    with ThreadPoolExecutor(max_workers=len(BUNDLE_FIELDS)) as executor:
+        futures = {
+            field: executor.submit(getattr if field in REQUIRED_BUNDLE_FIELDS else fetch_ticker_field, company, field)
+            for field in BUNDLE_FIELDS
         }
+        return {field: future.result() for field, future in futures.items()}
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=512)
+def fetch_company_data(ticker):
+    """Fetches and derives the displayed data for a ticker. Raises if info is unavailable so that error is never cached;
+    optional statements that fail to load are logged server-side and left as None."""
+    bundle = get_ticker_bundle(ticker)
+    info = bundle['info']
+    if not info:
+        raise ValueError(f"No data returned for {ticker}")
+    balance_sheet = bundle['quarterly_balance_sheet']
+    cash_flow = bundle['quarterly_cashflow']
+    calendar = bundle['calendar']
+
+    # Financial Metrics (most recent quarter, keyed by row label)
+    bs_map = balance_sheet.iloc[:, 0].to_dict() if balance_sheet is not None and not balance_sheet.empty else {}
+    balance_sheet_metrics = {
+        metric: next((bs_map[label] for label in labels if pd.notna(bs_map.get(label))), None)
+        for metric, labels in BALANCE_SHEET_LABELS.items()
+    }
+
+    # Key Data
+    get_info = info.get
+    currency = get_info('currency', 'INR' if ticker.endswith(INDIAN_EXCHANGE_SUFFIXES) else 'USD')
+    roe = get_info('returnOnEquity')
+    net_profit_margin = get_info('profitMargins')
+    dividend_yield = get_info('dividendYield')
+
+    company_data = CompanyData(
+        company=get_info('longName', ticker),
+        business_summary=get_info('longBusinessSummary', 'No business summary available'),
+        sector=get_info('sector'),
+        industry=get_info('industry'),
+        market_cap=get_info('marketCap'),
+        currency=currency,
+        financial_currency=get_info('financialCurrency', currency),  # statements may be reported in another currency
+        eps=get_info('trailingEps'),
+        pe_ratio=get_info('trailingPE'),
+        roe=roe,
+        net_profit_margin=net_profit_margin,
+        dividend_yield=dividend_yield,
+        roe_pct=roe * 100 if roe is not None else None,
+        net_profit_margin_pct=net_profit_margin * 100 if net_profit_margin is not None else None,
+        dividend_yield_pct=dividend_yield * 100 if dividend_yield is not None else None,
+        **balance_sheet_metrics,
+        calendar=calendar,
+        quarterly_balance_sheet=balance_sheet,
+        quarterly_cash_flow=cash_flow
+    )
+    return replace(company_data, **build_company_display(company_data))
+
+def is_valid_ticker(ticker):
+    """Reports and rejects malformed symbols before any network call."""
+    if _TICKER_RE.match(ticker):
+        return True
+    st.error(f"Invalid ticker format: {ticker}")
+    return False
+
+def load_company_data(ticker):
+    """Returns fetch_company_data(ticker), or None after reporting the failure in the UI."""
+    if not is_valid_ticker(ticker):
+        return None
+    try:
+        return fetch_company_data(ticker)
     except Exception as e:
         st.error(f"Error fetching data for {ticker}: {e}")
         return None
 
+# Comparison table column -> CompanyData field
+COMPARISON_COLUMNS = {
+    'Company': 'company',
+    'Sector': 'sector',
+    'EPS': 'eps',
+    'P/E Ratio': 'pe_ratio',
+    'ROE %': 'roe_pct',
+    'Dividend Yield %': 'dividend_yield_pct'
+}
+get_comparison_values = attrgetter(*COMPARISON_COLUMNS.values())
+
+def fetch_many(tickers):
+    """Fetches company data for several tickers concurrently, keyed by ticker; failures map to None."""
+    # 8 tickers x len(BUNDLE_FIELDS) requests each stays within the session's 32-connection pool.
+    # Workers carry the script's context so the cached fetch runs as it would on the script thread.
+    with ThreadPoolExecutor(max_workers=8, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as executor:
+        futures = {ticker: executor.submit(fetch_company_data, ticker) for ticker in tickers if is_valid_ticker(ticker)}
+    results = {}
+    # Errors are reported here, on the script thread, where st.error can reach the page
+    for ticker, future in futures.items():
+        try:
+            results[ticker] = future.result()
+        except Exception as e:
+            st.error(f"Error fetching data for {ticker}: {e}")
+            results[ticker] = None
+    return results
+
+_INDIAN_THRESHOLDS = (1e5, 1e7, 1e12)
+_INDIAN_DIVISORS = (1.0, 1e5, 1e7, 1e12)
+_INDIAN_SUFFIXES = ("", " Lakhs", " Crores", " Thousand Crores")
+
 def format_in_indian_style(number):
     """Formats numbers into Indian numbering style (Lakhs, Crores, Thousands of Crores)."""
-    if number is None:
+    if number is None or math.isnan(number):
+        return "Data not available"
+    bucket = bisect_right(_INDIAN_THRESHOLDS, number)
+    return f"₹{number / _INDIAN_DIVISORS[bucket]:.2f}{_INDIAN_SUFFIXES[bucket]}"
+
+def format_metric(value, template):
+    """Formats a metric with the given template; None/NaN are missing, zero is a real value."""
+    if value is None or math.isnan(value):
         return "Data not available"
-    elif number >= 1e12:
-        return f"₹{number / 1e12:.2f} Thousand Crores"
-    elif number >= 1e7:
-        return f"₹{number / 1e7:.2f} Crores"
-    elif number >= 1e5:
-        return f"₹{number / 1e5:.2f} Lakhs"
-    else:
-        return f"₹{number:.2f}"
+    return template.format(value)
+
+_WESTERN_THRESHOLDS = (1e6, 1e9, 1e12)
+_WESTERN_DIVISORS = (1.0, 1e6, 1e9, 1e12)
+_WESTERN_SUFFIXES = ("", " M", " B", " T")
+
+def format_money(number, currency="INR"):
+    """Formats an amount in its reporting currency: Indian units for INR, million/billion/trillion otherwise."""
+    if currency == "INR":
+        return format_in_indian_style(number)
+    if number is None or math.isnan(number):
+        return "Data not available"
+    bucket = bisect_right(_WESTERN_THRESHOLDS, number)
+    return f"{currency} {number / _WESTERN_DIVISORS[bucket]:.2f}{_WESTERN_SUFFIXES[bucket]}"
+
+def format_many_money(numbers, currencies):
+    """Batch version of format_money; picks every unit bucket with one searchsorted call per unit system."""
+    values = np.asarray(numbers, dtype=float)
+    is_inr = np.array([currency == "INR" for currency in currencies], dtype=bool)
+    buckets = np.where(
+        is_inr,
+        np.searchsorted(_INDIAN_THRESHOLDS, values, side='right'),
+        np.searchsorted(_WESTERN_THRESHOLDS, values, side='right')
+    )
+    return [
+        "Data not available" if np.isnan(value)
+        else f"₹{value / _INDIAN_DIVISORS[bucket]:.2f}{_INDIAN_SUFFIXES[bucket]}" if inr
+        else f"{currency} {value / _WESTERN_DIVISORS[bucket]:.2f}{_WESTERN_SUFFIXES[bucket]}"
+        for value, bucket, inr, currency in zip(values, buckets, is_inr, currencies)
+    ]
+
+_EXPLANATIONS = {
+    "Total Assets": "The total value of everything the company owns. Higher assets can mean more growth potential.",
+    "Total Liabilities": "The total debt the company owes. Less debt is often better for stability.",
+    "Long Term Debt": "Debt that is due in more than one year. It indicates the company’s long-term financial health.",
+    "EPS": "Earnings Per Share – how much profit the company generates per share. A higher EPS indicates better profitability.",
+    "P/E Ratio": "Price-to-Earnings ratio – compares the price of the stock to its earnings. A high P/E ratio could indicate an overvalued stock.",
+    "ROE": "Return on Equity – measures profitability based on shareholder equity. A higher ROE is generally good for investors.",
+    "Net Profit Margin": "The percentage of revenue that becomes profit. A higher margin means the company is better at converting sales into actual profit.",
+    "Dividend Yield": "The annual dividend payment divided by the stock price. A higher yield is attractive to income-focused investors."
+}
 
 def display_metric_explanation(metric_name):
-    explanations = {
-        "Total Assets": "The total value of everything the company owns. Higher assets can mean more growth potential.",
-        "Total Liabilities": "The total debt the company owes. Less debt is often better for stability.",
-        "Long Term Debt": "Debt that is due in more than one year. It indicates the company’s long-term financial health.",
-        "EPS": "Earnings Per Share – how much profit the company generates per share. A higher EPS indicates better profitability.",
-        "P/E Ratio": "Price-to-Earnings ratio – compares the price of the stock to its earnings. A high P/E ratio could indicate an overvalued stock.",
-        "ROE": "Return on Equity – measures profitability based on shareholder equity. A higher ROE is generally good for investors.",
-        "Net Profit Margin": "The percentage of revenue that becomes profit. A higher margin means the company is better at converting sales into actual profit.",
-        "Dividend Yield": "The annual dividend payment divided by the stock price. A higher yield is attractive to income-focused investors."
-    }
-    return explanations.get(metric_name, "No explanation available.")
+    return _EXPLANATIONS.get(metric_name, "No explanation available.")
 
-# Streamlit UI setup
-st.title('**Fundamental Analysis Tool**')
-st.sidebar.title("Options")
-ticker_input = st.sidebar.text_input("Enter Stock Ticker", value="RELIANCE.NS").upper()
+def build_metrics_table(formatted_values):
+    """Builds one Metric/Value/Explanation table so a section renders in a single call."""
+    return pd.DataFrame.from_records(
+        [(metric, value, display_metric_explanation(metric)) for metric, value in formatted_values.items()],
+        columns=("Metric", "Value", "Explanation")
+    )
 
-# Tabs for company analysis and screenshot functionality
-analysis_tab, screenshot_tab = st.tabs(["Company Analysis", "Screenshots"])
+def build_company_display(company_data):
+    """Builds the overview text and the fundamentals/financials tables, keyed by CompanyData field name."""
+    overview = "\n\n".join([
+        f"**Business Summary**: {company_data.business_summary}",
+        f"**Sector**: {company_data.sector}",
+        f"**Industry**: {company_data.industry}",
+        f"**Market Cap**: {format_money(company_data.market_cap, company_data.currency)}"
+    ])
+    currency_prefix = "₹" if company_data.currency == "INR" else f"{company_data.currency} "
+    fundamentals_table = build_metrics_table({
+        "EPS": format_metric(company_data.eps, currency_prefix + "{:.2f}"),
+        "P/E Ratio": format_metric(company_data.pe_ratio, "{:.2f}"),
+        "ROE": format_metric(company_data.roe_pct, "{:.2f}%"),
+        "Net Profit Margin": format_metric(company_data.net_profit_margin_pct, "{:.2f}%"),
+        "Dividend Yield": format_metric(company_data.dividend_yield_pct, "{:.2f}%")
+    })
+    financials_table = build_metrics_table({
+        "Total Assets": format_money(company_data.total_assets, company_data.financial_currency),
+        "Total Liabilities": format_money(company_data.total_liabilities, company_data.financial_currency),
+        "Long Term Debt": format_money(company_data.long_term_debt, company_data.financial_currency)
+    })
+    return {'overview': overview, 'fundamentals_table': fundamentals_table, 'financials_table': financials_table}
 
-if ticker_input:
-    company_data = fetch_company_data(ticker_input)
+@st.fragment
+def render_comparison():
+    """Comparison tab; edits to its ticker list rerun only this fragment, not the whole script."""
+    st.subheader("Comparison")
+    compare_input = st.text_area("Compare Tickers (comma-separated)", value="").upper()
+    compare_tickers = [ticker.strip() for ticker in compare_input.split(",") if ticker.strip()]
 
-    if company_data:
-        with analysis_tab:
-            st.subheader(f"Company Overview: {company_data['Company']}")
-            st.write(f"**Business Summary**: {company_data['Business Summary']}")
-            st.write(f"**Sector**: {company_data['Sector']}")
-            st.write(f"**Industry**: {company_data['Industry']}")
-            st.write(f"**Market Cap**: {format_in_indian_style(company_data['Market Cap'])}")
+    if compare_tickers:
+        comparison = {ticker: data for ticker, data in fetch_many(compare_tickers).items() if data}
+        market_caps = format_many_money(
+            [data.market_cap for data in comparison.values()],
+            [data.currency for data in comparison.values()]
+        )
+        st.dataframe(pd.DataFrame.from_records(
+            [(ticker, *get_comparison_values(data), market_cap) for (ticker, data), market_cap in zip(comparison.items(), market_caps)],
+            columns=('Ticker', *COMPARISON_COLUMNS, 'Market Cap')
+        ))
 
-            fundamentals_tab, financials_tab, statements_tab = st.tabs(["Fundamentals", "Financials", "Financial Statements"])
+def main():
+    # Initialize session state for screenshots if it doesn't exist
+    if "screenshots" not in st.session_state:
+        st.session_state["screenshots"] = []
 
-            with fundamentals_tab:
-                st.subheader("Fundamentals")
-                st.write(f"**EPS**: ₹{company_data['EPS']:.2f}" if company_data['EPS'] else "Data not available")
-                st.write(display_metric_explanation("EPS"))
+    # Streamlit UI setup
+    st.title('**Fundamental Analysis Tool**')
+    st.sidebar.title("Options")
+    ticker_input = st.sidebar.text_input("Enter Stock Ticker", value="RELIANCE.NS").strip().upper()
 
-                st.write(f"**P/E Ratio**: {company_data['P/E Ratio']:.2f}" if company_data['P/E Ratio'] else "Data not available")
-                st.write(display_metric_explanation("P/E Ratio"))
+    # Tabs for company analysis, comparison and screenshot functionality
+    analysis_tab, comparison_tab, screenshot_tab = st.tabs(["Company Analysis", "Comparison", "Screenshots"])
 
-                st.write(f"**ROE**: {company_data['ROE']*100:.2f}%" if company_data['ROE'] else "Data not available")
-                st.write(display_metric_explanation("ROE"))
+    if ticker_input:
+        company_data = load_company_data(ticker_input)
 
-                st.write(f"**Net Profit Margin**: {company_data['Net Profit Margin']*100:.2f}%" if company_data['Net Profit Margin'] else "Data not available")
-                st.write(display_metric_explanation("Net Profit Margin"))
+        if company_data:
+            with analysis_tab:
+                st.subheader(f"Company Overview: {company_data.company}")
+                st.markdown(company_data.overview)
 
-                st.write(f"**Dividend Yield**: {company_data['Dividend Yield']*100:.2f}%" if company_data['Dividend Yield'] else "Data not available")
-                st.write(display_metric_explanation("Dividend Yield"))
+                fundamentals_tab, financials_tab, statements_tab = st.tabs(["Fundamentals", "Financials", "Financial Statements"])
 
-            with financials_tab:
-                st.subheader("Financials")
-                st.write(f"**Total Assets**: {format_in_indian_style(company_data['Total Assets'])}")
-                st.write(display_metric_explanation("Total Assets"))
+                with fundamentals_tab:
+                    st.subheader("Fundamentals")
+                    st.table(company_data.fundamentals_table)
 
-                st.write(f"**Total Liabilities**: {format_in_indian_style(company_data['Total Liabilities'])}")
-                st.write(display_metric_explanation("Total Liabilities"))
+                with financials_tab:
+                    st.subheader("Financials")
+                    st.table(company_data.financials_table)
 
-                st.write(f"**Long Term Debt**: {format_in_indian_style(company_data['Long Term Debt'])}")
-                st.write(display_metric_explanation("Long Term Debt"))
+                with statements_tab:
+                    st.subheader("Financial Statements")
+                    st.write("**Quarterly Balance Sheet**:")
+                    st.dataframe(company_data.quarterly_balance_sheet)
 
-            with statements_tab:
-                st.subheader("Financial Statements")
-                st.write("**Quarterly Balance Sheet**:")
-                st.write(company_data['Quarterly Balance Sheet'])
+                    st.write("**Quarterly Cash Flow Statement**:")
+                    st.dataframe(company_data.quarterly_cash_flow)
 
-                st.write("**Quarterly Cash Flow Statement**:")
-                st.write(company_data['Quarterly Cash Flow'])
+                    st.write("**Calendar Data**:")
+                    st.write(company_data.calendar)
 
-                st.write("**Calendar Data**:")
-                st.write(company_data['Calendar'])
+    with comparison_tab:
+        render_comparison()
 
+if __name__ == "__main__":
+    main()